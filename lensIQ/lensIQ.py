@@ -2,10 +2,63 @@
 # (c)2023 Theia Technologies
 
 import numpy.polynomial.polynomial as nppp
+import math
 import numpy as np
 from scipy import optimize
 from typing import Tuple
 
+# numba is optional.  Without it the support functions run as plain Python.
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda f: f
+
+# 2D coefficient array from a calibration data coefficient list of lists
+# Shorter rows are padded with zeros (higher order terms) so every curve evaluates the same
+def _coefArray(coefList:list) -> np.ndarray:
+    coefArray = np.zeros((len(coefList), max(len(coef) for coef in coefList)))
+    for i, coef in enumerate(coefList):
+        coefArray[i, :len(coef)] = coef
+    return coefArray
+
+# evaluate the polynomial with coefficients 'c' (lowest order first) at 'x'
+# For the low order calibration polynomials this is much faster than nppp.polyval
+@njit(cache=True, fastmath=True)
+def _horner(x, c):
+    r = c[-1]
+    for i in range(len(c) - 2, -1, -1):
+        r = r * x + c[i]
+    return r
+
+# interpolate/ extrapolate between the curves of the two closest control points (see lensIQ.interpolate)
+# 'coefList' is a 2D array with a row for each value in the 'cp1List' array
+@njit(cache=True, fastmath=True)
+def _interpolate(coefList, cp1List, cp1Target, xValue):
+    # check for only one data set
+    if len(cp1List) <= 1:
+        return _horner(cp1Target, coefList[0])
+
+    # Find the indices of the closest lower and upper cp1 values
+    lowerIdx = -1
+    upperIdx = -1
+    for i in range(len(cp1List)):
+        diff = abs(cp1List[i] - cp1Target)
+        if lowerIdx < 0 or diff < abs(cp1List[lowerIdx] - cp1Target):
+            upperIdx = lowerIdx
+            lowerIdx = i
+        elif upperIdx < 0 or diff < abs(cp1List[upperIdx] - cp1Target):
+            upperIdx = i
+
+    # calculate the values
+    lowerValue = _horner(xValue, coefList[lowerIdx])
+    upperValue = _horner(xValue, coefList[upperIdx])
+
+    # Calculate the interpolation factor
+    interpolation_factor = (cp1Target - cp1List[lowerIdx]) / (cp1List[upperIdx] - cp1List[lowerIdx])
+
+    # Interpolate between the lower and upper coefficients
+    return lowerValue + interpolation_factor * (upperValue - lowerValue)
 
 # These functions are ease of use functions for setting and getting motor step positions
 # and relating them to engineering units.
@@ -19,6 +72,17 @@ class lensIQ():
     INFINITY = 1e6                      # infinite object distance
     OD_MIN_DEFAULT = 2                  # default minimum object distance is not specified in the calibration data file
     COC = 0.020                         # circle of confusion for DoF calcualtion
+    FOCUS_FIT_CACHE_SIZE = 64           # number of zoom step tracking fits cached for focusStep2OD
+    FL_LUT_MAX_STEPS = 100000           # maximum zoom steps for the zoom step to focal length look up table
+    FL_TOLERANCE = 2                    # tolerance beyond the FL range before FL2ZoomStep stops calculating
+    AOV_CACHE_SIZE = 16                 # number of sensor widths with cached calibrated AOV values for AOV2MotorSteps
+
+    # calibration data loaded flags
+    CAP_FL = 0x01                       # 'FL' focal length data
+    CAP_TRACK = 0x02                    # 'tracking' focus/zoom tracking data
+    CAP_AP = 0x04                       # 'AP' aperture data
+    CAP_DIST = 0x08                     # 'dist' distortion (angle of view) data
+    CAP_IRIS = 0x10                     # 'iris' iris diameter data
 
     # error list
     OK = 'OK'
@@ -89,9 +153,24 @@ class lensIQ():
         self.COC = lensIQ.COC
         self.sensorWd = 0
 
+        # calibration coefficient tables as numpy arrays (filled in loadData)
+        self._coef = {}
+        self._cp1 = {}
+        self._FLCoefInv = None
+        self._FLLUT = None
+        self._distFLSorted = None
+        self._APCompanion = None
+        self._focusFitCache = {}
+        self._AOVCache = {}
+        self._caps = 0
+
         # back focal length correction values
-        self.BFLCorrectionValues = []
+        # stored as columns [FL, focus shift, OD] x data points (see BFLCorrectionValues)
+        self._BFLData = np.empty((3, 8))
+        self._BFLCount = 0
         self.BFLCorrectionCoeffs = []
+        self.BFLCorrectionCov = None
+        self.BFLUseCurveFit = False
 
         # store the lens configuration
         # tsLatest is the id for the latest update after a calculation set.  Each configuation of the lens
@@ -117,8 +196,42 @@ class lensIQ():
         ['OK' | 'no cal data']
         '''
         self.calData = calData
+        self._coef = {}
+        self._cp1 = {}
+        self._FLCoefInv = None
+        self._FLLUT = None
+        self._distFLSorted = None
+        self._APCompanion = None
+        self._focusFitCache = {}
+        self._AOVCache = {}
+        self._caps = 0
         if calData == {}:
             return lensIQ.ERR_NO_CAL
+
+        # convert the coefficient tables to numpy arrays once so the conversion functions don't
+        # convert the lists on every call.  calData itself is not modified.  Curves with fewer 
+        # coefficients are zero padded to the longest curve in the table.
+        for key, cap in [('FL', lensIQ.CAP_FL), ('tracking', lensIQ.CAP_TRACK), ('AP', lensIQ.CAP_AP), ('dist', lensIQ.CAP_DIST), ('iris', lensIQ.CAP_IRIS)]:
+            if key not in calData: continue
+            self._caps |= cap
+            self._coef[key] = _coefArray(calData[key]['coef'])
+            self._cp1[key] = np.asarray(calData[key]['cp1'], dtype=np.float64)
+        if 'FL' in calData:
+            self._FLCoefInv = _coefArray(calData['FL']['coefInv'])
+            # focal length for every zoom motor step
+            if calData['zoomSteps'] < lensIQ.FL_LUT_MAX_STEPS:
+                self._FLLUT = nppp.polyval(np.arange(calData['zoomSteps'] + 1), self._FLCoefInv[0])
+        if 'dist' in calData:
+            self._distFLSorted = np.sort(self._cp1['dist'])
+        if 'AP' in calData:
+            # companion matrices of the NA v. irisStep curves for the NA2IrisStep root finding
+            coefList = self._coef['AP']
+            deg = coefList.shape[1] - 1
+            self._APCompanion = np.zeros((len(coefList), deg, deg))
+            self._APCompanion[:, 1:, :-1] = np.eye(deg - 1)
+            # rows with a 0 leading coefficient are not finite, NA2IrisStep uses nppp.polyroots for these
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self._APCompanion[:, :, -1] = -coefList[:, :-1] / coefList[:, -1:]
         
         # save initial step values
         self.lensConfiguration['zoomStep']['value'] = calData['zoomPI']
@@ -181,13 +294,17 @@ class lensIQ():
         [calculated focal length, note, FL Min, FL Max]
         'note' string value can be: ['OK', 'no cal data', 'FL min', 'FL max']
         '''
-        if 'FL' not in self.calData.keys(): return 0, lensIQ.ERR_NO_CAL, 0, 0
+        if not (self._caps & lensIQ.CAP_FL): return 0, lensIQ.ERR_NO_CAL, 0, 0
 
-        # extract the inverse polynomial coefficients
-        coef = self.calData['FL']['coefInv'][0]
+        # look up the result for whole zoom steps in the motor range
+        if self._FLLUT is not None and 0 <= zoomStep < len(self._FLLUT) and zoomStep == int(zoomStep):
+            FL = self._FLLUT[int(zoomStep)]
+        else:
+            # extract the inverse polynomial coefficients
+            coef = self._FLCoefInv[0]
 
-        # calculate the result
-        FL = nppp.polyval(zoomStep, coef)
+            # calculate the result
+            FL = _horner(zoomStep, coef)
 
         # validate the response
         err = lensIQ.OK
@@ -219,26 +336,21 @@ class lensIQ():
         [calculated object distance, note, OD min, OD max]
         'note' string value can be: ['OK', 'no cal data', 'OD min', 'OD max']
         '''
-        if 'tracking' not in self.calData.keys(): return 0, lensIQ.ERR_NO_CAL, 0, 0
+        if not (self._caps & lensIQ.CAP_TRACK): return 0, lensIQ.ERR_NO_CAL, 0, 0
         # calculation range limit constants, don't calculate outside these limits to avoid curve fitting wrap-around
         DONT_CALC_MAX_OVER = 100
         DONT_CALC_MIN_UNDER = 400
 
-        # extract the polynomial coefficients
-        cp1List = self.calData['tracking']['cp1']
-        coefList = self.calData['tracking']['coef']
-
         # calculate the focus step at different object distances for the zoom step
-        # add the BFL correction factor
-        focusStepList = []
-        for cp1, _val in enumerate(cp1List):
-            focusStepList.append(nppp.polyval(zoomStep, coefList[cp1]) + BFL)
+        # add the BFL correction factor.  These and the fit below are cached for the zoom step. 
+        fit = self._trackingFit(zoomStep, BFL)
+        focusStepList = fit['focusStep']
 
         # validate the focus step to make sure it is within the valid focus range
         err = lensIQ.OK
         OD = 0
-        ODMin = self.calData['odMin'] if 'odMin' in self.calData.keys() else lensIQ.OD_MIN_DEFAULT
-        ODMax = self.calData['odMax'] if 'odMax' in self.calData.keys() else lensIQ.INFINITY
+        ODMin = self.calData['odMin'] if 'odMin' in self.calData else lensIQ.OD_MIN_DEFAULT
+        ODMax = self.calData['odMax'] if 'odMax' in self.calData else lensIQ.INFINITY
 
         #   range goes from infinity focus [0] to minimum focus [len(cp1)]
         if focusStep > focusStepList[0] + DONT_CALC_MAX_OVER:
@@ -251,8 +363,9 @@ class lensIQ():
             OD = 'NA (near)'
         else:
             # fit the focusStepList/cp1List to find the object distance
-            coef = nppp.polyfit(focusStepList, cp1List, 3)
-            OD = 1000 / nppp.polyval(focusStep, coef)
+            if fit['coef'] is None:
+                fit['coef'] = nppp.polyfit(focusStepList, self._cp1['tracking'], 3)
+            OD = 1000 / _horner(focusStep, fit['coef'])
             # validate OD
             if OD < 0:
                 # points >infinity are calculaed as negative
@@ -279,14 +392,14 @@ class lensIQ():
         [NA, note, NAMin, NAMax]
         'note' string value can be: ['OK', 'no cal data', 'NA max', 'NA min']
         '''
-        if 'AP' not in self.calData.keys(): return 0, lensIQ.ERR_NO_CAL, 0, 0
+        if not (self._caps & lensIQ.CAP_AP): return 0, lensIQ.ERR_NO_CAL, 0, 0
 
         # extract data from calibration data file
-        NA = self.interpolate(self.calData['AP']['coef'], self.calData['AP']['cp1'], FL, irisStep)
+        NA = self.interpolate(self._coef['AP'], self._cp1['AP'], FL, irisStep)
 
         # calculate min/max values
-        NAMin = self.interpolate(self.calData['AP']['coef'], self.calData['AP']['cp1'], FL, self.calData['irisSteps'])
-        NAMax = self.interpolate(self.calData['AP']['coef'], self.calData['AP']['cp1'], FL, 0)
+        NAMin = self.interpolate(self._coef['AP'], self._cp1['AP'], FL, self.calData['irisSteps'])
+        NAMax = self.interpolate(self._coef['AP'], self._cp1['AP'], FL, 0)
 
         # validate the results
         NAMaxCal = (1/(2 * self.calData['fnum']))
@@ -319,7 +432,7 @@ class lensIQ():
         [FNum, note, FNumMin, FNumMax]
         'note' string value can be: ['OK', 'no cal data', 'NA max', 'NA min']
         '''
-        if 'AP' not in self.calData.keys(): return 0, lensIQ.ERR_NO_CAL, 0, 0
+        if not (self._caps & lensIQ.CAP_AP): return 0, lensIQ.ERR_NO_CAL, 0, 0
         NA, err, NAMin, NAMax = self.irisStep2NA(irisStep, FL)
         fNum = self.NA2FNum(NA)
         fNumMin = self.NA2FNum(NAMin)
@@ -345,32 +458,17 @@ class lensIQ():
         [zoomStep, note]
         'note' string value can be: ['OK' | 'no cal data' | 'out of range-min' | 'out of range-max']
         '''
-        if 'FL' not in self.calData.keys(): return 0, lensIQ.ERR_NO_CAL
-        err = lensIQ.OK
+        if not (self._caps & lensIQ.CAP_FL): return 0, lensIQ.ERR_NO_CAL
 
         # validate input value
         zoomStepMax = self.calData['zoomSteps']
-        FLTolerance = 2     # tolerance beyond FL range
-        if FL < self.calData['flMin'] - FLTolerance:
-            err = lensIQ.ERR_RANGE_MIN
-            zoomStep = zoomStepMax
-        elif FL > self.calData['flMax'] + FLTolerance:
-            err = lensIQ.ERR_RANGE_MAX
-            zoomStep = 0
+        if FL < self.calData['flMin'] - lensIQ.FL_TOLERANCE:
+            zoomStep, err = zoomStepMax, lensIQ.ERR_RANGE_MIN
+        elif FL > self.calData['flMax'] + lensIQ.FL_TOLERANCE:
+            zoomStep, err = 0, lensIQ.ERR_RANGE_MAX
         else:
-            # extract the polynomial coefficients
-            coef = self.calData['FL']['coef'][0]
-
-            # calculate the result
-            zoomStep = int(nppp.polyval(FL, coef))
-
-        # validate the response
-        if (zoomStep < 0):
-            err = lensIQ.ERR_RANGE_MIN
-            zoomStep = 0
-        elif (zoomStep > zoomStepMax):
-            err = lensIQ.ERR_RANGE_MAX
-            zoomStep = zoomStepMax
+            # calculate and validate the result
+            zoomStep, err = self._limitStep(int(_horner(FL, self._coef['FL'][0])), zoomStepMax)
 
         # save the results
         self.updateLensConfiguration('zoomStep', zoomStep)
@@ -392,25 +490,17 @@ class lensIQ():
         [focusStep, note]
         'note' string value can be: ['OK' | 'no cal data' | 'out of range-min' | 'out of range-max' | 'no OD set']
         '''
-        if 'tracking' not in self.calData.keys(): return 0, lensIQ.ERR_NO_CAL
+        if not (self._caps & lensIQ.CAP_TRACK): return 0, lensIQ.ERR_NO_CAL
 
         # extract the focus/zoom tracking polynomial data and interpolate to OD
         if OD == 0:
             # OD not set
             return 0, lensIQ.ERR_OD_VALUE
         invOD = 1000 / OD
-        focusStep = int(self.interpolate(self.calData['tracking']['coef'], self.calData['tracking']['cp1'], invOD, zoomStep))
-        focusStep += BFL
+        focusStep = int(self.interpolate(self._coef['tracking'], self._cp1['tracking'], invOD, zoomStep))
 
         # validate the result
-        err = lensIQ.OK
-        focusStepMax = self.calData['focusSteps']
-        if focusStep < 0:
-            err = lensIQ.ERR_RANGE_MIN
-            focusStep = 0
-        elif focusStep > focusStepMax:
-            err = lensIQ.ERR_RANGE_MAX
-            focusStep = focusStepMax
+        focusStep, err = self._limitStep(focusStep + BFL, self.calData['focusSteps'])
 
         # save the results
         self.updateLensConfiguration('focusStep', focusStep)
@@ -451,38 +541,59 @@ class lensIQ():
         [iris motor step, note]
         'note' string value can be: ['OK' | 'no cal data' | 'NA min' | 'NA max']
         '''
-        if 'AP' not in self.calData.keys(): return 0, lensIQ.ERR_NO_CAL
+        if not (self._caps & lensIQ.CAP_AP): return 0, lensIQ.ERR_NO_CAL
 
         # find 2 closest focal lengths in the calibrated data file to the target
-        FLList = np.subtract(self.calData['AP']['cp1'], FL)
-
-        # sort the FL differences from 0 (root) and save the list indexes
-        FLIdx = np.argsort(np.abs(FLList))
-        closestFL = np.add(np.array(FLList)[np.sort(FLIdx[:2])], FL)
-
-        # define the merit function (NA v. irisStep) for the root finding
-        def merit(x, coef, target):
-            return nppp.polyval(x, coef) - target
-
-        # find the coefficients for each focal length and calcualte the iris step for the target NA
+        cp1List = self._cp1['AP']
+        FLList = cp1List - FL
+
+        # find the 2 smallest FL differences from 0 (root) and save the list indexes in cp1 order
+        FLIdx = np.argpartition(np.abs(FLList), 1)
+        closestIdx = np.sort(FLIdx[:2])
+        closestFL = cp1List[closestIdx]
+
+        # find the coefficients for both focal lengths, the maximum NA is at iris step 0
+        coefList = self._coef['AP'][closestIdx]
+        NAMax = coefList[:, 0]
+
+        # find the roots of the NA v. irisStep curves shifted by the target NA 
+        # (eigenvalues of the companion matrices of both curves together).  Shifting the
+        # constant term only changes the first value of the last column (indexing returns a copy).
+        companion = self._APCompanion[closestIdx]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            companion[:, 0, -1] += NA / coefList[:, -1]
+        if np.isfinite(companion).all():
+            roots = np.linalg.eigvals(companion)
+        else:
+            # leading coefficient is 0 (zero padded curve), find the roots of each curve separately
+            # nppp.polyroots trims the trailing zeros, missing roots are NaN
+            roots = np.full((len(coefList), coefList.shape[1] - 1), np.nan, dtype=complex)
+            for i, coef in enumerate(coefList):
+                shifted = coef.copy()
+                shifted[0] -= NA
+                curveRoots = nppp.polyroots(shifted)
+                roots[i, :len(curveRoots)] = curveRoots
+
+        # use the real root in the iris range closest to the nominal iris step
+        irisSteps = self.calData['irisSteps']
+        validRoot = (np.abs(roots.imag) < 1e-9) & (roots.real >= 0) & (roots.real <= irisSteps)
+        rootIdx = np.argmin(np.where(validRoot, np.abs(roots.real - 20), np.inf), axis=1)
+        stepValueList = roots.real[np.arange(len(roots)), rootIdx]
+
+        # no root in the iris range due to excessively negative NA value
+        noRoot = ~validRoot.any(axis=1)
+        stepValueList[noRoot] = irisSteps
+        # NA larger than the maximum
+        NATooLarge = NA >= NAMax
+        stepValueList[NATooLarge] = 0
+
+        # the note is from the last focal length with an error
         err = lensIQ.OK
-        coef = []
-        stepValueList = []
-        for f in closestFL:
-            idx = self.calData['AP']['cp1'].index(f)
-            coef = self.calData['AP']['coef'][idx]
-            NAMax = nppp.polyval(0, coef)
-            if NA < NAMax:
-                try:
-                    stepValue = optimize.newton(merit, 20, args=(coef, NA,))
-                except RuntimeError as e:
-                    # no convergence due to excessively negative NA value
-                    stepValue = self.calData['irisSteps']
-                    err = lensIQ.ERR_NA_MIN
-            else:
-                stepValue = 0
+        for tooLarge, tooSmall in zip(NATooLarge, noRoot):
+            if tooLarge:
                 err = lensIQ.ERR_NA_MAX
-            stepValueList.append(stepValue)
+            elif tooSmall:
+                err = lensIQ.ERR_NA_MIN
 
         # interpolate between step values
         interpolationFactor = (FL - closestFL[0]) / (closestFL[1] - closestFL[0])
@@ -503,7 +614,7 @@ class lensIQ():
         [iris motor step, note]
         'note' string value can be: ['OK' | 'no cal data' | 'NA min' | 'NA max']
         '''
-        if 'AP' not in self.calData.keys(): return 0, lensIQ.ERR_NO_CAL
+        if not (self._caps & lensIQ.CAP_AP): return 0, lensIQ.ERR_NO_CAL
 
         # calcualte the NA
         NA = self.FNum2NA(fNum)
@@ -528,34 +639,28 @@ class lensIQ():
         [focusStep, zoomStep, calculated focal length, note]
         'note' string value can be: ['OK' | 'no cal data' | 'out of range-min' | 'out of range-max' | 'OD value']
         '''
-        if 'dist' not in self.calData.keys(): return 0, 0, 0, lensIQ.ERR_NO_CAL
+        if not (self._caps & lensIQ.CAP_DIST): return 0, 0, 0, lensIQ.ERR_NO_CAL
 
         # get the maximum angle of view for each focal length in the calibration data file
-        FLLower = None
-        FLUpper = None
-        FLList = np.sort(self.calData['dist']['cp1'])
-        for FL in FLList:
-            AOVMax, _err = self.calcAOV(sensorWd, FL)
-            if AOVMax > AOV:
-                FLLower = [FL, AOVMax]
-            elif FLUpper == None:
-                FLUpper = [FL, AOVMax]
-
-        # check if AOV is greater than maximum AOV for the lens (not wide angle enough)
-        if FLLower == None:
-            # re-calculate to extrapolate focal length
-            FLLower = FLUpper
-            FL = FLList[1]
-            AOVMax, _err = self.calcAOV(sensorWd, FL)
-            FLUpper = [FL, AOVMax]
-
-        # check if AOV is less than the minimum AOV for the lens (not telephoto enough)
-        if FLUpper == None:
-            # recalcualte to extrapolate focal length
-            FLUpper = FLLower
-            FL = FLList[-2]
-            AOVMax, _err = self.calcAOV(sensorWd, FL)
-            FLLower = [FL, AOVMax]
+        FLList = self._distFLSorted
+        AOVList = self._AOVList(sensorWd)
+
+        if AOV >= AOVList[0]:
+            # AOV is not less than the maximum AOV for the lens (not wide angle enough)
+            # use the first two focal lengths to extrapolate
+            FLLower = [FLList[0], AOVList[0]]
+            FLUpper = [FLList[1], AOVList[1]]
+        elif AOV <= AOVList[-1]:
+            # AOV is less than the minimum AOV for the lens (not telephoto enough)
+            # use the last two focal lengths to extrapolate
+            FLLower = [FLList[-2], AOVList[-2]]
+            FLUpper = [FLList[-1], AOVList[-1]]
+        else:
+            # find the focal lengths closest to the AOV (last wider and first narrower)
+            # AOV decreases with focal length so search the negative AOV values
+            idx = np.searchsorted(-AOVList, -AOV)
+            FLLower = [FLList[idx - 1], AOVList[idx - 1]]
+            FLUpper = [FLList[idx], AOVList[idx]]
 
         # interpolate to get the focal length value
         interpolationFactor = (AOV - FLLower[1]) / (FLUpper[1] - FLLower[1])
@@ -604,7 +709,7 @@ class lensIQ():
         [focusStep, zoomStep, calcualted FL, note]
         'note' string value can be: ['OK' | 'no cal data' | 'out of range-min' | 'out of range-max' | 'calculation error' | 'OD value']
         '''
-        if 'dist' not in self.calData.keys(): return 0, 0, 0, lensIQ.ERR_NO_CAL
+        if not (self._caps & lensIQ.CAP_DIST): return 0, 0, 0, lensIQ.ERR_NO_CAL
         AOV = self.FOV2AOV(FOV, OD)
         if AOV == 0:
             return 0, 0, 0, lensIQ.ERR_CALC
@@ -628,17 +733,51 @@ class lensIQ():
         [full angle of view (deg), note]
         'note' string value can be: ['OK', 'no cal data']
         '''
-        if 'dist' not in self.calData.keys(): return 0, lensIQ.ERR_NO_CAL
+        if not (self._caps & lensIQ.CAP_DIST): return 0, lensIQ.ERR_NO_CAL
         semiWd = sensorWd / 2
 
         # extract the object angle value
-        semiAOV = abs(self.interpolate(self.calData['dist']['coef'], self.calData['dist']['cp1'], FL, semiWd))
+        semiAOV = abs(self.interpolate(self._coef['dist'], self._cp1['dist'], FL, semiWd))
         AOV = 2 * semiAOV
 
         # save the results
         if saveAOV: self.updateLensConfiguration('AOV', AOV)
         return AOV, lensIQ.OK
     
+    # calculate angle of view for an array of focal lengths
+    def _calcAOVArray(self, sensorWd:float, FLList:np.ndarray) -> np.ndarray:
+        '''
+        Calculate angle of view (full angle) for an array of focal lengths. 
+        This is the same calculation as calcAOV but all the focal lengths are calculated together and 
+        the results are not saved to the lensConfiguration. 
+        ### input
+        - sensorWd: width of sensor for horizontal AOV
+        - FLList: array of focal lengths
+        ### return
+        array of full angle of view (deg)
+        '''
+        semiWd = sensorWd / 2
+        return 2 * np.abs(self._interpolateArray(self._coef['dist'], self._cp1['dist'], FLList, semiWd))
+
+    # angle of view of each calibrated focal length
+    def _AOVList(self, sensorWd:float) -> np.ndarray:
+        '''
+        Angle of view (full angle) of each calibrated focal length (sorted) in the 'dist' calibration data. 
+        The results are cached by sensor width (oldest are removed after 'AOV_CACHE_SIZE' entries). 
+        ### input
+        - sensorWd: width of sensor for horizontal AOV
+        ### return
+        array of full angle of view (deg)
+        '''
+        AOVList = self._AOVCache.get(sensorWd)
+        if AOVList is None:
+            AOVList = self._calcAOVArray(sensorWd, self._distFLSorted)
+            if len(self._AOVCache) >= lensIQ.AOV_CACHE_SIZE:
+                # remove the oldest sensor width
+                del self._AOVCache[next(iter(self._AOVCache))]
+            self._AOVCache[sensorWd] = AOVList
+        return AOVList
+
     # calculate the AOV limits for the lens (minimum and maximum)
     def calcAOVLimits(self) -> Tuple[float, float, str]:
         '''
@@ -670,11 +809,11 @@ class lensIQ():
         [full field of view (m), note]
         'note' string value can be: ['OK', 'no cal data']
         '''
-        if 'dist' not in self.calData.keys(): return 0, lensIQ.ERR_NO_CAL
+        if not (self._caps & lensIQ.CAP_DIST): return 0, lensIQ.ERR_NO_CAL
         AOV, _err  = self.calcAOV(sensorWd, FL)
 
         # calcualte the FOV at the object distance
-        FOV = 2 * OD * np.tan(np.radians(AOV / 2))
+        FOV = 2 * OD * math.tan(math.radians(AOV / 2))
         
         # save the results
         self.updateLensConfiguration('FOV', FOV)
@@ -694,11 +833,11 @@ class lensIQ():
         [depth of field, note, minimum object distance, maximum object distance]
         'note' string value can be: ['OK' | 'no cal data']
         '''
-        if 'iris' not in self.calData.keys(): return 0, lensIQ.ERR_NO_CAL, 0, 0
+        if not (self._caps & lensIQ.CAP_IRIS): return 0, lensIQ.ERR_NO_CAL, 0, 0
         if OD >= lensIQ.INFINITY: return lensIQ.INFINITY, lensIQ.OK, lensIQ.INFINITY, lensIQ.INFINITY
 
         # extract the aperture size
-        shortDiameter = self.interpolate(self.calData['iris']['coef'], self.calData['iris']['cp1'], FL, irisStep)
+        shortDiameter = self.interpolate(self._coef['iris'], self._cp1['iris'], FL, irisStep)
 
         # calculate the magnification
         OD = max(0.001, OD)
@@ -706,9 +845,10 @@ class lensIQ():
 
         # calculate min and max object distances
         # denominator ratios are unitless so calculations are in the units of object distance
-        ODMin = min(OD / (1 + self.COC / (shortDiameter * magnification)), lensIQ.INFINITY)
-        ODMax = min(OD / (1 - self.COC / (shortDiameter * magnification)), lensIQ.INFINITY)
-        if ODMax < 0: ODMax = lensIQ.INFINITY
+        # the far limit is at infinity when the ratio is >= 1
+        ratio = self.COC / (shortDiameter * magnification)
+        ODMin = min(OD / (1 + ratio), lensIQ.INFINITY)
+        ODMax = min(OD / (1 - ratio), lensIQ.INFINITY) if ratio < 1 else lensIQ.INFINITY
 
         # calculate depth of field
         if ODMax == lensIQ.INFINITY:
@@ -813,6 +953,33 @@ class lensIQ():
     ### back focal length correction functions ###
     ### -------------------------------------- ###
 
+    # BFL correction data points
+    @property
+    def BFLCorrectionValues(self) -> list:
+        '''
+        BFL correction data points. 
+        The points are stored as arrays for fitting, this returns a copy as a new list each time.  FL and OD 
+        values are floats and whole number focus steps are ints.  Changes to the returned list are not stored; 
+        use addBFLCorrection/ addBFLCorrectionBatch to add points or assign the changed list to 
+        'BFLCorrectionValues' (this also re-fits the data). 
+        ### return
+        [[FL, step, OD],[...]]
+        '''
+        values = []
+        for FL, step, OD in self._BFLData[:, :self._BFLCount].T.tolist():
+            values.append([FL, int(step) if step.is_integer() else step, OD])
+        return values
+
+    @BFLCorrectionValues.setter
+    def BFLCorrectionValues(self, values:list):
+        values = np.asarray(values, dtype=np.float64).reshape(-1, 3)
+        self._BFLCount = len(values)
+        self._BFLData = np.empty((3, max(8, self._BFLCount)))
+        self._BFLData[:, :self._BFLCount] = values.T
+
+        # re-fit the data
+        self.fitBFLCorrection()
+
     # back focal length correction factor
     ##### TBD add object distance OD; currently all OD will be included in the fitting together
     def BFLCorrection(self, FL:float, OD:float=1000000) -> int:
@@ -834,7 +1001,7 @@ class lensIQ():
             # no correction values set up yet
             return 0
         # calculate the correction step for the focal length
-        correctionValue = nppp.polyval(FL, self.BFLCorrectionCoeffs)
+        correctionValue = _horner(FL, self.BFLCorrectionCoeffs)
         return int(correctionValue)
 
     # store data points for BFL correction
@@ -852,11 +1019,39 @@ class lensIQ():
         [[FL, step, OD],[...]]
         Current set point BFL correction list 
         '''
-        # find the default focus step for infinity object distance
-        designFocusStep, _err = self.ODFL2FocusStep(OD, FL, BFL=0)
+        return self.addBFLCorrectionBatch([[focusStep, FL, OD]])
 
-        # save the focus shift amount
-        self.BFLCorrectionValues.append([FL, focusStep - designFocusStep, OD])
+    # store a set of data points for BFL correction
+    def addBFLCorrectionBatch(self, points:list) -> list:
+        '''
+        Store a set of data points for BFL correction. 
+        This is the same as addBFLCorrection for each point but the design focus steps are calculated
+        for all points together and the data is only re-fit once.  
+        ### input
+        - points: [[focusStep, FL, OD],[...]] best focus step, focal length and object distance (in meters) for each point
+        ### return
+        [[FL, step, OD],[...]]
+        Current set point BFL correction list 
+        '''
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        focusStepList, FLList, ODList = points.T
+
+        # find the design focus step for each point (same as ODFL2FocusStep)
+        designFocusStepList = np.zeros(len(points))
+        if self._caps & lensIQ.CAP_TRACK:
+            zoomStepList = np.zeros(len(points))
+            if self._caps & lensIQ.CAP_FL:
+                zoomStepList, _errList = self._FL2ZoomStepArray(FLList)
+            designFocusStepList, _errList = self._OD2FocusStepArray(ODList, zoomStepList)
+
+        # save the focus shift amounts, double the storage until it fits
+        while self._BFLCount + len(points) > self._BFLData.shape[1]:
+            self._BFLData = np.concatenate((self._BFLData, np.empty_like(self._BFLData)), axis=1)
+        newCount = self._BFLCount + len(points)
+        self._BFLData[0, self._BFLCount:newCount] = FLList
+        self._BFLData[1, self._BFLCount:newCount] = focusStepList - designFocusStepList
+        self._BFLData[2, self._BFLCount:newCount] = ODList
+        self._BFLCount = newCount
 
         # re-fit the data
         self.fitBFLCorrection()
@@ -873,36 +1068,72 @@ class lensIQ():
         [[FL, step, OD],[...]]
         Current set point BFL correction list 
         '''
-        if idx < 0 or idx >= len(self.BFLCorrectionValues):
+        if idx < 0 or idx >= self._BFLCount:
             return self.BFLCorrectionValues
 
         # delete the item
-        del self.BFLCorrectionValues[idx]
+        self._BFLData[:, idx:self._BFLCount - 1] = self._BFLData[:, idx + 1:self._BFLCount]
+        self._BFLCount -= 1
 
         # re-fit the data
         self.fitBFLCorrection()
         return self.BFLCorrectionValues
 
     # curve fit the BFL correction list
-    def fitBFLCorrection(self):
+    def fitBFLCorrection(self, useCurveFit:bool=None):
         '''
         Curve fit the BFL correction list.  Global list variable 'BFLCorrectionCoeffs' list is updated.  
+        The quadratic fit (> 3 data points) can optionally use scipy curve_fit which also saves the 
+        coefficient covariance matrix to 'BFLCorrectionCov'.  Otherwise 'BFLCorrectionCov' is None. 
+        The useCurveFit setting is saved to 'BFLUseCurveFit' and also used when adding or removing points re-fits the data. 
+        With no data points 'BFLCorrectionCoeffs' is cleared (no correction). 
         ### input
-        none
+        - useCurveFit (optional: saved setting, initially False): use curve_fit for the quadratic fit
         ### return
         none
         '''
-        xy = np.transpose(self.BFLCorrectionValues)
+        if useCurveFit is None:
+            useCurveFit = self.BFLUseCurveFit
+        self.BFLUseCurveFit = useCurveFit
+        xy = self._BFLData[:, :self._BFLCount]
+        self.BFLCorrectionCov = None
         # fit the data
-        if len(self.BFLCorrectionValues) == 1:
+        if self._BFLCount == 0:
+            # no data points, no correction
+            self.BFLCorrectionCoeffs = []
+            return
+        elif self._BFLCount == 1:
             # single data point, constant offset
-            self.BFLCorrectionCoeffs = xy[1]
-        elif len(self.BFLCorrectionValues) <= 3:
+            coeffs = xy[1].copy()
+        elif self._BFLCount <= 3:
             # linear fit for up to 3 data points
-            self.BFLCorrectionCoeffs = nppp.polyfit(xy[0], xy[1], 1)
+            coeffs = self._polyfitSmall(xy[0], xy[1], 1)
+        elif useCurveFit:
+            # quadratic fit for > 3 data points with the covariance
+            coeffs, self.BFLCorrectionCov = optimize.curve_fit(lambda x, *c: nppp.polyval(x, c), xy[0], xy[1], p0=np.zeros(3))
         else:
             # quadratic fit for > 3 data points
-            self.BFLCorrectionCoeffs = nppp.polyfit(xy[0], xy[1], 2)
+            coeffs = self._polyfitSmall(xy[0], xy[1], 2)
+        self.BFLCorrectionCoeffs = np.ascontiguousarray(coeffs, dtype=np.float64)
+
+    # least squares polynomial fit for low order fits
+    def _polyfitSmall(self, x:np.ndarray, y:np.ndarray, deg:int) -> np.ndarray:
+        '''
+        Least squares polynomial fit for low order fits. 
+        This is the same scaled least squares solution as nppp.polyfit (including the minimum norm solution 
+        when there are not enough distinct x values for the degree) without the nppp.polyfit input checking overhead. 
+        ### input
+        - x, y: data points
+        - deg: polynomial degree
+        ### return
+        polynomial coefficients (lowest order first)
+        '''
+        # scale the Vandermonde columns to unit length to keep the system well conditioned
+        A = np.vander(x, deg + 1, increasing=True)
+        scale = np.sqrt((A * A).sum(axis=0))
+        scale[scale == 0] = 1
+        coeffs = np.linalg.lstsq(A / scale, y, rcond=len(x) * np.finfo(x.dtype).eps)[0]
+        return coeffs / scale
 
 
     ### ----------------- ###
@@ -950,7 +1181,7 @@ class lensIQ():
         # check for 'infinity' input to FOV or OD
         if isinstance(FOV, str) or isinstance(OD, str) or (OD == 0) or (FOV == 0):
             return 0
-        AOV = np.degrees(2 * np.arctan((FOV / 2) / OD))
+        AOV = math.degrees(2 * math.atan((FOV / 2) / OD))
         return AOV
     
     # store data in the lensConfig structure
@@ -972,6 +1203,139 @@ class lensIQ():
         self.lensConfiguration[key]['ts'] = self.lensConfiguration['tsLatest']
         return 
 
+    # focus steps of the tracking curves at a zoom step
+    def _trackingFit(self, zoomStep:int, BFL:int) -> dict:
+        '''
+        Focus steps of the tracking curves at a zoom step. 
+        The results are cached by zoom step and BFL (least recently used are removed after 'FOCUS_FIT_CACHE_SIZE' entries) 
+        so repeated calls at the same zoom step don't need to recalculate.  
+        ### input
+        - zoomStep: zoom motor step number
+        - BFL: back focus correction in focus steps
+        ### return
+        {'focusStep': focus step array for each cp1, 'coef': inverse fit coefficients (None until calculated)}
+        '''
+        key = (zoomStep, BFL)
+        fit = self._focusFitCache.pop(key, None)
+        if fit is None:
+            # evaluate all the tracking curves in one call
+            fit = {'focusStep': nppp.polyval(zoomStep, self._coef['tracking'].T) + BFL, 'coef': None}
+            if len(self._focusFitCache) >= lensIQ.FOCUS_FIT_CACHE_SIZE:
+                # remove the least recently used fit
+                del self._focusFitCache[next(iter(self._focusFitCache))]
+        # (re)insert as the most recently used
+        self._focusFitCache[key] = fit
+        return fit
+
+    # limit a motor step to the available range
+    def _limitStep(self, step:int, stepMax:int) -> Tuple[int, str]:
+        '''
+        Limit a motor step to the available range [0, stepMax]. 
+        ### input
+        - step: calculated motor step
+        - stepMax: maximum motor step
+        ### return
+        [step, note]
+        'note' string value can be: ['OK' | 'out of range-min' | 'out of range-max']
+        '''
+        if step < 0:
+            return 0, lensIQ.ERR_RANGE_MIN
+        elif step > stepMax:
+            return stepMax, lensIQ.ERR_RANGE_MAX
+        return step, lensIQ.OK
+
+    # zoom steps for an array of focal lengths
+    def _FL2ZoomStepArray(self, FLList:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Zoom steps for an array of focal lengths (the FL2ZoomStep calculation for addBFLCorrectionBatch). 
+        The zoom steps are limited to the available range.  Focal lengths more than 'FL_TOLERANCE' outside 
+        the FL range are not calculated. 
+        ### input
+        - FLList: focal length (or array of focal lengths)
+        ### return
+        [zoomStep array, note array]
+        'note' string values can be: ['OK' | 'out of range-min' | 'out of range-max']
+        '''
+        FLList = np.atleast_1d(np.asarray(FLList, dtype=np.float64))
+        zoomStepMax = self.calData['zoomSteps']
+
+        # calculate the result, use the range limits for focal lengths too far outside the range
+        FLTooSmall = FLList < self.calData['flMin'] - lensIQ.FL_TOLERANCE
+        FLTooLarge = FLList > self.calData['flMax'] + lensIQ.FL_TOLERANCE
+        zoomStepList = np.trunc(nppp.polyval(FLList, self._coef['FL'][0]))
+        zoomStepList[FLTooSmall] = zoomStepMax
+        zoomStepList[FLTooLarge] = 0
+
+        # validate the response
+        errList = np.full(len(FLList), lensIQ.OK, dtype=object)
+        errList[FLTooSmall | (zoomStepList < 0)] = lensIQ.ERR_RANGE_MIN
+        errList[FLTooLarge | (zoomStepList > zoomStepMax)] = lensIQ.ERR_RANGE_MAX
+        return np.clip(zoomStepList, 0, zoomStepMax), errList
+
+    # focus steps for arrays of object distances and zoom steps
+    def _OD2FocusStepArray(self, ODList:np.ndarray, zoomStepList:np.ndarray, BFL:int=0) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Focus steps for arrays of object distances and zoom steps (the OD2FocusStep calculation for addBFLCorrectionBatch). 
+        The focus steps are limited to the available range.  Object distance 0 is not set and returns focus step 0. 
+        ### input
+        - ODList: object distance (or array of object distances)
+        - zoomStepList: zoom step (or array of zoom steps)
+        - BFL (optional: 0): back focus step adjustment
+        ### return
+        [focusStep array, note array]
+        'note' string values can be: ['OK' | 'out of range-min' | 'out of range-max' | 'OD value']
+        '''
+        ODList = np.atleast_1d(np.asarray(ODList, dtype=np.float64))
+        focusStepMax = self.calData['focusSteps']
+
+        # interpolate the focus/zoom tracking curves to the inverse OD
+        ODSet = ODList != 0
+        invODList = 1000 / np.where(ODSet, ODList, 1)
+        focusStepList = np.trunc(self._interpolateArray(self._coef['tracking'], self._cp1['tracking'], invODList, zoomStepList)) + BFL
+
+        # validate the result
+        errList = np.full(len(ODList), lensIQ.OK, dtype=object)
+        errList[focusStepList < 0] = lensIQ.ERR_RANGE_MIN
+        errList[focusStepList > focusStepMax] = lensIQ.ERR_RANGE_MAX
+        errList[~ODSet] = lensIQ.ERR_OD_VALUE
+        focusStepList = np.where(ODSet, np.clip(focusStepList, 0, focusStepMax), 0)
+        return focusStepList, errList
+
+    # interpolate/ extrapolate between two values of control points for arrays of targets
+    def _interpolateArray(self, coefList:np.ndarray, cp1List:np.ndarray, cp1TargetList:np.ndarray, xValueList:np.ndarray) -> np.ndarray:
+        '''
+        Interpolate/ extrapolate between two values of control points for arrays of targets. 
+        This is the same calculation as interpolate but for each cp1 target and x value pair together. 
+        ### input
+        - coefList: 2D coefficient array for all cp1 values
+        - cp1List: cp1 control point 1 array corresponding to the coefficients
+        - cp1TargetList: array of target control points
+        - xValueList: array of x evaluation values (or a single value for all targets)
+        ### return
+        array of interpolated values
+        '''
+        cp1TargetList = np.atleast_1d(np.asarray(cp1TargetList, dtype=np.float64))
+        xValueList = np.broadcast_to(np.asarray(xValueList, dtype=np.float64), cp1TargetList.shape)
+
+        # check for only one data set
+        if len(cp1List) <= 1:
+            return nppp.polyval(cp1TargetList, coefList[0])
+
+        # values of each curve at each x value [cp1, target]
+        valueList = nppp.polyval(xValueList, coefList.T)
+
+        # Find the indices of the closest lower and upper cp1 values for each target
+        valIdx = np.argpartition(np.abs(cp1List[np.newaxis, :] - cp1TargetList[:, np.newaxis]), 1, axis=1)
+        lowerIdx = valIdx[:, 0]
+        upperIdx = valIdx[:, 1]
+        targetIdx = np.arange(len(cp1TargetList))
+        lowerValue = valueList[lowerIdx, targetIdx]
+        upperValue = valueList[upperIdx, targetIdx]
+
+        # interpolate between the lower and upper values
+        interpolationFactor = (cp1TargetList - cp1List[lowerIdx]) / (cp1List[upperIdx] - cp1List[lowerIdx])
+        return lowerValue + interpolationFactor * (upperValue - lowerValue)
+
     # interpolate/ extrapolate between two values of control points
     def interpolate(self, coefList:list, cp1List:list, cp1Target:float, xValue:float) -> float:
         '''
@@ -980,13 +1344,23 @@ class lensIQ():
         The curves for the two closest control points around the target are selected and the
         'xValue' is calculated for each.  Then the results are interpolated to get to the cp1 target.
         ### input
-        - coefList: coefficient list of lists for all cp1 values
-        - cp1List: cp1 control point 1 list corresponding to the coefficients
+        - coefList: coefficient list of lists (or 2D array) for all cp1 values
+        - cp1List: cp1 control point 1 list (or array) corresponding to the coefficients
         - cp1Target: target control point target
-        - xValue: x evaluation value
+        - xValue: x evaluation value (or array of values)
         ### return
         interpolated value
         '''
+        # scalar values with curves of the same length use the compiled support function
+        if np.ndim(cp1Target) == 0 and np.ndim(xValue) == 0:
+            try:
+                coefArray = np.asarray(coefList, dtype=np.float64)
+            except ValueError:
+                # curves with different lengths
+                coefArray = None
+            if coefArray is not None and coefArray.ndim == 2:
+                return _interpolate(np.ascontiguousarray(coefArray), np.ascontiguousarray(cp1List, dtype=np.float64), float(cp1Target), float(xValue))
+
         # check for only one data set
         if len(cp1List) <= 1:
             return nppp.polyval(cp1Target, coefList[0])